@@ -1,8 +1,8 @@
 import os
-import re
 from operator import itemgetter
 
 import bpy
+import numpy as np
 from bpy.props import (
     BoolProperty,
     CollectionProperty,
@@ -13,7 +13,12 @@ from bpy.props import (
 )
 from bpy_extras.io_utils import ImportHelper
 
-from . import convert_TIF_to_XYZ, sort_xyz_files
+from . import (
+    convert_TIF_to_XYZ,
+    estimate_import_size,
+    import_pipeline,
+    sort_xyz_files,
+)
 
 try:
     from pyproj import CRS, Transformer
@@ -38,6 +43,18 @@ bl_info = {
 }
 
 
+# Size in meters of a 1km² tile, the grid of each file is padded to it
+TILE_SIZE = 1000.0
+
+# Coordinates are snapped to a grid with this many decimals (centimeters)
+GRID_DECIMALS = 2
+GRID_TOLERANCE = 10**-GRID_DECIMALS
+
+# Maximum number of grid cells per point in a file (or per cell of a full tile)
+# before the grid is refused
+MAX_GRID_CELLS_PER_POINT = 10
+
+
 def calculate_size(vertices):
     xSize = (
         next(
@@ -58,7 +75,9 @@ def convert_utm_32_to_33(coordinate):
     return (new_coordinate[0], new_coordinate[1], coordinate[2])
 
 
-def get_coordinates_from_file(filename, ignore_rows, ignore_columns, scale, origin):
+def get_coordinates_from_file(
+    filename, ignore_rows, ignore_columns, scale, origin, check_for_km2, nodata
+):
     if filename.split("_")[1] == "33":
         origin = convert_utm_32_to_33(origin)
 
@@ -71,26 +90,6 @@ def get_coordinates_from_file(filename, ignore_rows, ignore_columns, scale, orig
     if not delimiter:
         raise ValueError("Could not determine delimiter")
 
-    xSize = 0
-    lines = []
-    currentY = 0
-    with open(filename, "r") as file:
-        for i, line in enumerate(file):
-            if i == 0:
-                currentY = float(re.split(delimiter, line.strip())[1])
-            elif currentY != float(re.split(delimiter, line.strip())[1]):
-                xSize = i
-                break
-
-        if xSize == 0:
-            raise ValueError("Could not determine xSize")
-
-        file.seek(0)  # Reset file pointer to the beginning
-        for i, line in enumerate(file):
-            if (i // xSize) % ignore_rows == 0:
-                if (i % xSize) % ignore_columns == 0:
-                    lines.append(line)
-
     # Check if all origin coordinates are floats
     if not all(isinstance(o, float) for o in origin):
         print(origin)
@@ -98,46 +97,213 @@ def get_coordinates_from_file(filename, ignore_rows, ignore_columns, scale, orig
             print(type(o))
         raise ValueError("Origin coordinates must be floats")
 
-    # Read and sort the vertices coordinates (sort by x and y)
-    vertices = sorted(
-        [
-            (
-                (float(re.split(delimiter, r.strip())[0]) - origin[0]) * scale,
-                (float(re.split(delimiter, r.strip())[1]) - origin[1]) * scale,
-                (float(re.split(delimiter, r.strip())[2]) - origin[2]) * scale,
-            )
-            for r in lines
-        ],
-        key=itemgetter(0, 1),
+    x_coords, y_coords, heights = read_xyz_grid(
+        filename, delimiter, TILE_SIZE if check_for_km2 else None, nodata
     )
 
-    if len(vertices) < 2:
+    # Only select every nth row and column
+    first_column = stride_start(x_coords, ignore_columns)
+    first_row = stride_start(y_coords, ignore_rows)
+    x_coords = x_coords[first_column::ignore_columns]
+    y_coords = y_coords[first_row::ignore_rows]
+    heights = heights[first_row::ignore_rows, first_column::ignore_columns]
+
+    if heights.size < 2:
         raise ValueError("Not enough vertices to determine xSize")
 
+    # Order the vertices by x and y, masked heights become NaN
+    xs, ys = np.meshgrid(x_coords, y_coords, indexing="ij")
+    coordinates = np.column_stack(
+        (
+            (xs.ravel() - origin[0]) * scale,
+            (ys.ravel() - origin[1]) * scale,
+            (heights.T.filled(np.nan).ravel() - origin[2]) * scale,
+        )
+    )
+    vertices = list(map(tuple, coordinates.tolist()))
+
     xSize, ySize = calculate_size(vertices)
 
     return vertices, xSize, ySize
 
 
+def grid_spacing(values):
+    """
+    Determine the grid spacing along one axis.
+
+    The grid spacing is the median distance between neighbouring coordinates,
+    coordinates closer than GRID_TOLERANCE are treated as the same grid line.
+
+    :param values: The coordinates along one axis.
+    :return: The grid spacing, or None if all coordinates lie on one grid line.
+    """
+    diffs = np.diff(np.unique(values))
+    diffs = diffs[diffs > GRID_TOLERANCE]
+    if len(diffs) == 0:
+        return None
+    return np.round(np.median(diffs), GRID_DECIMALS)
+
+
+def snap_to_grid(values, spacing, tile_size):
+    """
+    Snap the coordinates along one axis to a regular grid.
+
+    The grid is padded to the tile bounds (or to the coordinates if tile_size
+    is None), so tiles with missing edge rows keep their full extent.
+
+    :param values: The coordinates along one axis.
+    :param spacing: The grid spacing along the axis.
+    :param tile_size: The size of the tiles in meters, or None.
+    :return: A tuple (coords, indices), the coordinates of the grid lines and the grid index of each value.
+    """
+    unique = np.unique(values)
+
+    if tile_size:
+        tile_start = np.floor((unique[0] + GRID_TOLERANCE) / tile_size) * tile_size
+        offset = np.round((unique[0] - tile_start) % spacing, GRID_DECIMALS) % spacing
+        start = tile_start + offset
+        tile_end = tile_start + tile_size * max(
+            np.ceil((unique[-1] - GRID_TOLERANCE - tile_start) / tile_size), 1
+        )
+        count = int(np.ceil((tile_end - start) / spacing - GRID_TOLERANCE))
+    else:
+        start = np.round(unique[0], GRID_DECIMALS)
+        count = 0
+
+    indices = np.rint((values - start) / spacing).astype(np.intp)
+    if np.abs(values - (start + indices * spacing)).max() > spacing / 4:
+        raise ValueError("Coordinates do not lie on a regular grid")
+
+    count = max(count, indices.max() + 1)
+
+    return start + spacing * np.arange(count), indices
+
+
+def read_xyz_grid(filename, delimiter, tile_size, nodata):
+    """
+    Read a .xyz/.txt file into a regular grid of heights.
+
+    Missing rows, NaN heights and heights equal to the nodata value are masked.
+
+    :param filename: The path to the .xyz/.txt file.
+    :param delimiter: The delimiter between the columns of the file.
+    :param tile_size: The size of the tiles in meters the grid is padded to, or None.
+    :param nodata: The height marking a missing value.
+    :return: A tuple (x_coords, y_coords, heights), heights is a masked array of shape (len(y_coords), len(x_coords)).
+    """
+    data = np.loadtxt(
+        filename,
+        delimiter=None if delimiter.isspace() else delimiter,
+        usecols=(0, 1, 2),
+        ndmin=2,
+    )
+    x, y, z = data.T
+
+    x_spacing = grid_spacing(x)
+    y_spacing = grid_spacing(y)
+    if tile_size:
+        # A strip of a single row or column along the tile border takes the
+        # spacing of the other axis
+        x_spacing = x_spacing or y_spacing
+        y_spacing = y_spacing or x_spacing
+    if x_spacing is None or y_spacing is None:
+        raise ValueError("Could not determine the grid spacing")
+
+    x_coords, columns = snap_to_grid(x, x_spacing, tile_size)
+    y_coords, rows = snap_to_grid(y, y_spacing, tile_size)
+
+    # Refuse to allocate a grid far larger than expected, e.g. for scattered points
+    if tile_size:
+        # Tiles may be mostly nodata, so compare the padded grid to a full tile
+        cells = len(x_coords) * len(y_coords)
+        expected = round(tile_size / x_spacing) * round(tile_size / y_spacing)
+    else:
+        cells = (np.ptp(columns) + 1) * (np.ptp(rows) + 1)
+        expected = len(z)
+    if cells > MAX_GRID_CELLS_PER_POINT * expected:
+        raise ValueError(
+            f"Grid of {len(x_coords)}x{len(y_coords)} is too large for {len(z)} points"
+        )
+
+    # Grid points without a row in the file stay NaN
+    grid = np.full((len(y_coords), len(x_coords)), np.nan)
+    grid[rows, columns] = z
+
+    heights = np.ma.masked_values(np.ma.masked_invalid(grid), nodata)
+
+    return x_coords, y_coords, heights
+
+
+def fill_grid(vertices):
+    """
+    Fill the grid points missing between the vertices of all files with NaN heights.
+
+    Files of different extents are merged into one rectangular grid this way.
+
+    :param vertices: The deduplicated vertices, sorted by x and y.
+    :return: The vertices of the full grid, sorted by x and y.
+    """
+    coordinates = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    x_coords = np.unique(coordinates[:, 0])
+    y_coords = np.unique(coordinates[:, 1])
+    if len(x_coords) * len(y_coords) == len(coordinates):
+        return vertices
+
+    if len(x_coords) * len(y_coords) > MAX_GRID_CELLS_PER_POINT * len(coordinates):
+        raise ValueError(
+            f"Grid of {len(x_coords)}x{len(y_coords)} is too large for {len(coordinates)} vertices"
+        )
+
+    heights = np.full((len(x_coords), len(y_coords)), np.nan)
+    heights[
+        np.searchsorted(x_coords, coordinates[:, 0]),
+        np.searchsorted(y_coords, coordinates[:, 1]),
+    ] = coordinates[:, 2]
+
+    xs, ys = np.meshgrid(x_coords, y_coords, indexing="ij")
+    coordinates = np.column_stack((xs.ravel(), ys.ravel(), heights.ravel()))
+    return list(map(tuple, coordinates.tolist()))
+
+
+def stride_start(coords, stride):
+    """
+    Find the first grid line to select, so that every nth grid line lines up across tiles.
+    """
+    if len(coords) < 2:
+        return 0
+    spacing = coords[1] - coords[0]
+    return int(-np.floor(coords[0] / spacing + GRID_TOLERANCE) % stride)
+
+
 def create_polygon_mesh(vertices, xSize, ySize, ob_name):
+    coordinates = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    valid = ~np.isnan(coordinates[:, 2])
+
     # Generate the polygons
-    polygons = []
-    for i in range(ySize - 1):
-        for j in range(xSize - 1):
-            polygons.append(
-                (
-                    i * xSize + j,
-                    i * xSize + j + 1,
-                    (i + 1) * xSize + j + 1,
-                    (i + 1) * xSize + j,
-                )
-            )
+    indices = np.arange(xSize * ySize).reshape(ySize, xSize)
+    polygons = np.stack(
+        (
+            indices[:-1, :-1],
+            indices[:-1, 1:],
+            indices[1:, 1:],
+            indices[1:, :-1],
+        ),
+        axis=-1,
+    ).reshape(-1, 4)
+
+    # Skip polygons touching masked vertices and drop the masked vertices
+    polygons = polygons[valid[polygons].all(axis=1)]
+    new_indices = np.cumsum(valid) - 1
+    polygons = new_indices[polygons]
+    vertices = coordinates[valid]
 
     name = ob_name
     mesh = bpy.data.meshes.new(name)
     obj = bpy.data.objects.new(name, mesh)
 
-    obj.data.from_pydata(vertices, [], polygons)  # Associate vertices and polygons
+    obj.data.from_pydata(
+        vertices.tolist(), [], polygons.tolist()
+    )  # Associate vertices and polygons
 
     obj.scale = (1, 1, 1)
     for p in obj.data.polygons:  # Set smooth shading
@@ -236,17 +402,20 @@ def find_closest_edges(vertices, edges, x_size, y_size):
     return all_vertices_on_closest_x, all_vertices_on_closest_y, combined_closest
 
 
-def process_file(
-    path_to_file, edges, all_vertices, ignore_rows, ignore_columns, scale, origin
-):
-    vertices, file_xSize, file_ySize = get_coordinates_from_file(
-        path_to_file,
-        ignore_rows,
-        ignore_columns,
-        scale,
-        origin,
-    )
+def prepare_file(path_to_file, check_for_km2):
+    # Distinguish between different file types
+    if path_to_file.endswith(".xyz") or path_to_file.endswith(".txt"):
+        if not sort_xyz_files.check_xyz_file(path_to_file, check_for_km2):
+            raise ValueError(f"File {path_to_file} failed the check")
+        return path_to_file
+    elif path_to_file.endswith(".tif"):
+        convert_TIF_to_XYZ.process_path(path_to_file)
+        return path_to_file.replace(".tif", ".xyz")
+    else:
+        raise ValueError("Invalid file type")
+
 
+def stitch_file(vertices, file_xSize, file_ySize, edges, all_vertices):
     try:
         vertices_on_x, vertices_on_y, combined_closest = find_closest_edges(
             vertices, edges, file_xSize, file_ySize
@@ -278,6 +447,14 @@ def process_file(
     all_vertices.extend(vertices)
 
 
+def get_error_line(error):
+    # Line where the error was raised, not where it was caught
+    traceback = error.__traceback__
+    while traceback.tb_next:
+        traceback = traceback.tb_next
+    return traceback.tb_lineno
+
+
 def main(
     files,
     folder,
@@ -286,6 +463,8 @@ def main(
     coordinate_system,
     ignore_rows,
     ignore_columns,
+    check_for_km2,
+    nodata,
 ):
     # Sort all files by name
     files = sorted(list(files), key=lambda x: x.name)
@@ -294,41 +473,33 @@ def main(
 
     all_vertices = []
 
-    for i, file in enumerate(files):
-        try:
-            print(f"File {i + 1}/{len(files)}: {file.name}")
-            path_to_file = os.path.join(folder, file.name)
-
-            # Distinguish between different file types
-            if path_to_file.endswith(".xyz") or path_to_file.endswith(".txt"):
-                process_file(
-                    path_to_file,
-                    edges,
-                    all_vertices,
-                    ignore_rows,
-                    ignore_columns,
-                    scale,
-                    origin,
-                )
-
-            elif path_to_file.endswith(".tif"):
-                convert_TIF_to_XYZ.process_path(path_to_file)
+    # Prepare and parse the next files while the current one is stitched
+    results = import_pipeline.run_pipeline(
+        [os.path.join(folder, file.name) for file in files],
+        [
+            lambda path_to_file: prepare_file(path_to_file, check_for_km2),
+            lambda xyz_path: get_coordinates_from_file(
+                xyz_path,
+                ignore_rows,
+                ignore_columns,
+                scale,
+                origin,
+                check_for_km2,
+                nodata,
+            ),
+        ],
+    )
 
-                xyz_path = path_to_file.replace(".tif", ".xyz")
+    for i, (file, (_, result, error)) in enumerate(zip(files, results)):
+        print(f"File {i + 1}/{len(files)}: {file.name}")
+        if error is not None:
+            print(f"Error importing {file.name}: {error} at {get_error_line(error)}")
+            continue
 
-                process_file(
-                    xyz_path,
-                    edges,
-                    all_vertices,
-                    ignore_rows,
-                    ignore_columns,
-                    scale,
-                    origin,
-                )
-            else:
-                raise ValueError("Invalid file type")
+        try:
+            stitch_file(*result, edges, all_vertices)
         except Exception as e:
-            print(f"Error importing {file.name}: {e} at {e.__traceback__.tb_lineno}")
+            print(f"Error importing {file.name}: {e} at {get_error_line(e)}")
             continue
 
     all_vertices = sorted(all_vertices, key=itemgetter(0, 1))
@@ -336,10 +507,11 @@ def main(
     all_vertices = [
         all_vertices[i]
         for i in range(len(all_vertices))
-        if i == 0 or all_vertices[i] != all_vertices[i - 1]
+        if i == 0 or all_vertices[i][:2] != all_vertices[i - 1][:2]
     ]
 
     try:
+        all_vertices = fill_grid(all_vertices)
         create_polygon_mesh(
             all_vertices,
             calculate_size(all_vertices)[0],
@@ -393,11 +565,52 @@ class DGMDirectorySelector(bpy.types.Operator, ImportHelper):
         description="Select the coordinate system of the data",
         items=(("epsg:25832", "EPSG:25832", "EPSG:25832 coordinate system"),),
     )  # type: ignore
+    nodata_value: FloatProperty(
+        name="Nodata Value",
+        description="Height that marks missing values in .xyz/.txt files, these are left out of the mesh",
+        precision=1,
+        default=-9999.0,
+    )  # type: ignore
+    check_for_km2: BoolProperty(
+        name="Check for 1km² tiles",
+        description="Skip .xyz/.txt files with more rows than a 1000m x 1000m grid with 1m resolution. Disable this to import other resolutions, e.g. 0.5m tiles",
+        default=True,
+    )  # type: ignore
     limit_data: BoolProperty(
         name="Limit Data by ignoring rows and/or columns",
         description="Since it might be a large dataset, you can limit the data by ignoring rows and/or columns. CAUTION: Disabling this option might lead to performance issues and/or crashes",
         default=True,
     )  # type: ignore
+    limit_method: EnumProperty(
+        name="Limit Method",
+        description="Select how the rows and columns to ignore are determined",
+        items=(
+            ("MANUAL", "Manual", "Set the rows and columns to ignore manually"),
+            (
+                "VERTEX_BUDGET",
+                "Vertex Budget",
+                "Ignore as few rows and columns as possible while staying below the vertex budget",
+            ),
+            (
+                "MEMORY_BUDGET",
+                "Memory Budget",
+                "Ignore as few rows and columns as possible while staying below the estimated memory budget",
+            ),
+        ),
+        default="MANUAL",
+    )  # type: ignore
+    vertex_budget: IntProperty(
+        name="Vertex Budget",
+        description="Maximum number of vertices to import over all files",
+        min=4,
+        default=2000000,
+    )  # type: ignore
+    memory_budget: IntProperty(
+        name="Memory Budget (MB)",
+        description="Maximum estimated memory in megabytes the import may use",
+        min=1,
+        default=2048,
+    )  # type: ignore
     ignore_rows: IntProperty(
         name="Ignore Rows",
         description="Only select every nth row",
@@ -434,6 +647,16 @@ class DGMDirectorySelector(bpy.types.Operator, ImportHelper):
         row.label(text="Coordinate System:")
         row.prop(self, "coordinate_system", text="")
 
+        box = layout.box()
+        row = box.row(align=True)
+        row.label(text="Check for 1km² Tiles:")
+        row.prop(self, "check_for_km2", text="")
+
+        box = layout.box()
+        row = box.row(align=True)
+        row.label(text="Nodata Value:")
+        row.prop(self, "nodata_value", text="")
+
         box = layout.box()
         row = box.row(align=True)
         row.label(text="Limit Data:")
@@ -441,22 +664,76 @@ class DGMDirectorySelector(bpy.types.Operator, ImportHelper):
 
         if self.limit_data:
             row = box.row(align=True)
-            row.prop(self, "ignore_rows", text="Ignore Rows")
-            row = box.row(align=True)
-            row.prop(self, "ignore_columns", text="Ignore Columns")
+            row.prop(self, "limit_method", text="")
+
+            if self.limit_method == "MANUAL":
+                row = box.row(align=True)
+                row.prop(self, "ignore_rows", text="Ignore Rows")
+                row = box.row(align=True)
+                row.prop(self, "ignore_columns", text="Ignore Columns")
+            elif self.limit_method == "VERTEX_BUDGET":
+                row = box.row(align=True)
+                row.prop(self, "vertex_budget", text="Vertices")
+            elif self.limit_method == "MEMORY_BUDGET":
+                row = box.row(align=True)
+                row.prop(self, "memory_budget", text="Memory (MB)")
+
+    def get_limits(self, folder):
+        """Determine the rows and columns to ignore from the estimated size of the selected files."""
+        use_budget = self.limit_data and self.limit_method != "MANUAL"
+
+        dimensions = []
+        for file in self.files:
+            try:
+                dimensions.append(
+                    estimate_import_size.estimate_file_dimensions(
+                        os.path.join(folder, file.name), self.check_for_km2
+                    )
+                )
+            except Exception as e:
+                # The estimate is only needed to pick the stride for a budget,
+                # otherwise the import reports the error for this file
+                if use_budget:
+                    raise
+                print(f"Error estimating size of {file.name}: {e}")
+
+        if not self.limit_data:
+            ignore_rows = ignore_columns = 1
+        elif self.limit_method == "VERTEX_BUDGET":
+            ignore_rows = ignore_columns = estimate_import_size.find_stride(
+                dimensions, self.vertex_budget
+            )
+        elif self.limit_method == "MEMORY_BUDGET":
+            ignore_rows = ignore_columns = estimate_import_size.find_stride(
+                dimensions,
+                estimate_import_size.vertex_budget_from_memory(
+                    dimensions, self.memory_budget * 1024 * 1024
+                ),
+            )
+        else:
+            ignore_rows, ignore_columns = self.ignore_rows, self.ignore_columns
+
+        vertex_count = estimate_import_size.count_vertices(
+            dimensions, ignore_rows, ignore_columns
+        )
+        memory = estimate_import_size.estimate_memory(
+            dimensions, ignore_rows, ignore_columns
+        )
+        print(
+            f"Estimated import size: {vertex_count} vertices, {memory / 1024 / 1024:.0f} MB "
+            f"(every {ignore_rows}. row, every {ignore_columns}. column)"
+        )
+
+        return ignore_rows, ignore_columns
 
     def execute(self, context):
         folder = os.path.dirname(self.filepath)
 
-        print(f"Sorting XYZ files in folder {folder}")
-
         try:
-            sort_xyz_files.sort_all_xyz_files_in_folder(
-                folder_path=folder, check_for_km2=True, multiprocessing=False
-            )
+            ignore_rows, ignore_columns = self.get_limits(folder)
         except Exception as e:
-            self.report({"ERROR"}, f"Error sorting XYZ files: {e}")
-            print(f"Error sorting XYZ files: {e}")
+            self.report({"ERROR"}, f"Error estimating import size: {e}")
+            print(f"Error estimating import size: {e}")
             return {"CANCELLED"}
 
         print(f"Importing DGM files from folder {folder}")
@@ -472,8 +749,10 @@ class DGMDirectorySelector(bpy.types.Operator, ImportHelper):
                     self.origin_setting_z,
                 ),
                 coordinate_system=self.coordinate_system,
-                ignore_rows=self.ignore_rows,
-                ignore_columns=self.ignore_columns,
+                ignore_rows=ignore_rows,
+                ignore_columns=ignore_columns,
+                check_for_km2=self.check_for_km2,
+                nodata=self.nodata_value,
             )
             self.report({"INFO"}, f"{len(self.files)} files imported successfully")
             print(f"{len(self.files)} files imported successfully")
@@ -1,6 +1,8 @@
 import os
 import sys
 
+import numpy as np
+
 # Try importing rasterio. If it fails, install it with the blender python
 # interpreter.
 try:
@@ -26,8 +28,8 @@ except ImportError:
 def convert_tif_to_xyz(tif_path, xyz_path):
     # Open the .tif file
     with rasterio.open(tif_path) as src:
-        # Read the height data
-        height_data = src.read(1)
+        # Read the height data, nodata values are masked
+        height_data = src.read(1, masked=True)
         # Get the affine transform for the dataset
         transform_affine = src.transform
         # Define the source and destination coordinate systems
@@ -35,27 +37,27 @@ def convert_tif_to_xyz(tif_path, xyz_path):
         dst_crs = CRS.from_epsg(25832)  # UTM zone 32N
         transformer = Transformer.from_crs(src_crs, dst_crs, always_xy=True)
 
-        coordinates = []
+        # Get the x, y coordinates of all rows and columns in the source CRS
+        rows, cols = np.indices(height_data.shape)
+        x, y = transform_affine * (cols.ravel(), rows.ravel())
+        # Transform the coordinates to UTM 32
+        utm_x, utm_y = transformer.transform(x, y)
+        # Get the height values, masked values are written as NaN
+        heights = height_data.astype(np.float64).filled(np.nan).ravel()
 
-        # Iterate over the rows and columns of the height data
-        for row in range(height_data.shape[0]):
-            for col in range(height_data.shape[1]):
-                # Get the x, y coordinates in the source CRS
-                x, y = transform_affine * (col, row)
-                # Transform the coordinates to UTM 32
-                utm_x, utm_y = transformer.transform(x, y)
-                # Get the height value
-                height = height_data[row, col]
-                # Store the data in the list
-                coordinates.append((utm_x, utm_y, height))
+        coordinates = np.column_stack((utm_x, utm_y, heights))
 
         # Sort the coordinates
-        coordinates.sort(key=lambda coord: (coord[1], coord[0]))
+        coordinates = coordinates[np.lexsort((coordinates[:, 0], coordinates[:, 1]))]
 
         # Write the sorted data to the .xyz file
-        with open(xyz_path, "w") as xyz_file:
-            for coord in coordinates:
-                xyz_file.write(f"{coord[0]} {coord[1]} {coord[2]}\n")
+        np.savetxt(xyz_path, coordinates, fmt="%s")
+
+
+def get_tif_dimensions(tif_path):
+    # Only read the header of the .tif file
+    with rasterio.open(tif_path) as src:
+        return src.width, src.height
 
 
 def process_file(tif_path):
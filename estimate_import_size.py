@@ -0,0 +1,164 @@
+import math
+import os
+import re
+
+from . import convert_TIF_to_XYZ, sort_xyz_files
+
+# Rough number of bytes needed per imported vertex: the vertex tuple, the
+# sorted/stitched copies, the polygon lists and the Blender mesh data.
+BYTES_PER_VERTEX = 700
+
+# Rough number of bytes needed per sample of a tile while it is converted or
+# parsed at full resolution, before only every nth row and column is kept.
+BYTES_PER_SAMPLE = 150
+
+# Number of tiles held at full resolution at the same time: one being
+# converted/checked and one being parsed by the import pipeline.
+TILES_IN_FLIGHT = 2
+
+# Number of bytes to read from the start of a file to estimate its line length
+SAMPLE_SIZE = 64 * 1024
+
+
+def estimate_xyz_dimensions(file_path, check_for_km2):
+    """
+    Estimate the grid dimensions of a .xyz/.txt file without parsing it.
+
+    :param file_path: The path to the .xyz/.txt file.
+    :param check_for_km2: If True, a file whose size matches about 1,000,000 rows is treated as a 1000m x 1000m grid with 1m resolution.
+    :return: A tuple (columns, rows).
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "r") as file:
+        sample = file.read(SAMPLE_SIZE)
+
+    lines = [line for line in sample.splitlines() if line.strip()]
+    if not lines:
+        raise ValueError(f"Could not read any rows from {file_path}")
+
+    # Find delimiter by searching for the first character that is not a valid character in a float
+    delimiter = next((char for char in lines[0] if char not in "0123456789.-"), None)
+    if not delimiter:
+        raise ValueError("Could not determine delimiter")
+
+    # The rows are sorted by y, so the number of columns is the length of the first run of equal y values
+    first_y = float(re.split(delimiter, lines[0].strip())[1])
+    columns = next(
+        (
+            i
+            for i, line in enumerate(lines)
+            if float(re.split(delimiter, line.strip())[1]) != first_y
+        ),
+        None,
+    )
+
+    # Average length of a line including the line break
+    line_length = len(sample.encode()) / max(sample.count("\n"), 1)
+    total_rows = max(int(file_size / line_length), 1)
+
+    if check_for_km2 and sort_xyz_files.is_km2_row_count(total_rows):
+        return 1000, 1000
+
+    if columns is None:
+        # The first row is longer than the sample, fall back to a square grid
+        columns = max(int(math.sqrt(total_rows)), 1)
+
+    return columns, math.ceil(total_rows / columns)
+
+
+def estimate_file_dimensions(file_path, check_for_km2):
+    """
+    Estimate the grid dimensions of a DGM file from its header or file size.
+
+    :param file_path: The path to the .xyz, .txt or .tif file.
+    :param check_for_km2: If True, .xyz/.txt files matching about 1,000,000 rows are treated as 1000m x 1000m grids with 1m resolution.
+    :return: A tuple (columns, rows).
+    """
+    if file_path.endswith(".tif"):
+        return convert_TIF_to_XYZ.get_tif_dimensions(file_path)
+    elif file_path.endswith(".xyz") or file_path.endswith(".txt"):
+        return estimate_xyz_dimensions(file_path, check_for_km2)
+    else:
+        raise ValueError("Invalid file type")
+
+
+def count_vertices(dimensions, ignore_rows, ignore_columns):
+    """
+    Count the vertices that remain after only selecting every nth row and column.
+
+    :param dimensions: A list of (columns, rows) tuples, one per file.
+    :param ignore_rows: Only select every nth row.
+    :param ignore_columns: Only select every nth column.
+    :return: The number of vertices over all files.
+    """
+    return sum(
+        math.ceil(rows / ignore_rows) * math.ceil(columns / ignore_columns)
+        for columns, rows in dimensions
+    )
+
+
+def estimate_parse_memory(dimensions):
+    """
+    Estimate the memory in bytes that is needed for the tiles held at full resolution during the import.
+
+    :param dimensions: A list of (columns, rows) tuples, one per file.
+    """
+    largest_tiles = sorted(
+        (columns * rows for columns, rows in dimensions), reverse=True
+    )
+    return sum(largest_tiles[:TILES_IN_FLIGHT]) * BYTES_PER_SAMPLE
+
+
+def estimate_memory(dimensions, ignore_rows, ignore_columns):
+    """
+    Estimate the memory in bytes that is needed to import the files.
+
+    This covers the decimated vertices and mesh as well as the tiles that are
+    parsed at full resolution before only every nth row and column is kept.
+
+    :param dimensions: A list of (columns, rows) tuples, one per file.
+    :param ignore_rows: Only select every nth row.
+    :param ignore_columns: Only select every nth column.
+    """
+    vertex_count = count_vertices(dimensions, ignore_rows, ignore_columns)
+    return vertex_count * BYTES_PER_VERTEX + estimate_parse_memory(dimensions)
+
+
+def vertex_budget_from_memory(dimensions, memory_budget):
+    """
+    Convert a memory budget in bytes to the number of vertices that fit into it.
+
+    :param dimensions: A list of (columns, rows) tuples, one per file.
+    :param memory_budget: The maximum memory in bytes the import may use.
+    """
+    parse_memory = estimate_parse_memory(dimensions)
+    if parse_memory >= memory_budget:
+        raise ValueError(
+            f"Memory budget is too small, parsing the tiles at full resolution needs about {parse_memory / 1024 / 1024:.0f} MB"
+        )
+
+    return max((memory_budget - parse_memory) // BYTES_PER_VERTEX, 1)
+
+
+def find_stride(dimensions, vertex_budget):
+    """
+    Find the smallest stride that keeps the number of vertices within the budget.
+
+    The same stride is used for rows and columns of all files, so that the
+    vertices on the edges of neighbouring tiles line up and can be stitched.
+
+    :param dimensions: A list of (columns, rows) tuples, one per file.
+    :param vertex_budget: The maximum number of vertices to import.
+    :return: The stride to use for both ignore_rows and ignore_columns.
+    """
+    total = count_vertices(dimensions, 1, 1)
+    stride = max(int(math.sqrt(total / max(vertex_budget, 1))), 1)
+
+    max_stride = max((max(columns, rows) for columns, rows in dimensions), default=1)
+    while (
+        stride < max_stride
+        and count_vertices(dimensions, stride, stride) > vertex_budget
+    ):
+        stride += 1
+
+    return stride
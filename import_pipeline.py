@@ -0,0 +1,67 @@
+import queue
+import threading
+
+# Marks the end of the items passed from one stage to the next
+_DONE = object()
+
+
+def _feed(items, out_queue):
+    for item in items:
+        out_queue.put((item, item, None))
+    out_queue.put(_DONE)
+
+
+def _run_stage(stage, in_queue, out_queue):
+    while True:
+        entry = in_queue.get()
+        if entry is _DONE:
+            out_queue.put(_DONE)
+            return
+
+        item, value, error = entry
+        # Items that failed in an earlier stage are passed on unchanged
+        if error is None:
+            try:
+                value = stage(value)
+            except Exception as e:
+                error = e
+        out_queue.put((item, value, error))
+
+
+def run_pipeline(items, stages, queue_size=2):
+    """
+    Pass every item through a chain of stages, running each stage in its own thread.
+
+    Each stage receives the result of the previous stage (the first stage
+    receives the item itself). The queues between the stages are bounded, so
+    a fast stage can only run queue_size items ahead of the next one. As soon
+    as an item has passed all stages it is yielded, while the stages keep
+    working on the following items.
+
+    :param items: The items to process, in the order they should be yielded.
+    :param stages: A list of functions, each taking the result of the previous stage.
+    :param queue_size: The maximum number of items waiting between two stages.
+    :return: A generator of (item, result, error) tuples, error is the exception
+        raised by the first failing stage or None.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    threads = [threading.Thread(target=_feed, args=(items, queues[0]), daemon=True)]
+    for stage, in_queue, out_queue in zip(stages, queues, queues[1:]):
+        threads.append(
+            threading.Thread(
+                target=_run_stage, args=(stage, in_queue, out_queue), daemon=True
+            )
+        )
+
+    for thread in threads:
+        thread.start()
+
+    while True:
+        entry = queues[-1].get()
+        if entry is _DONE:
+            break
+        yield entry
+
+    for thread in threads:
+        thread.join()
@@ -11,6 +11,8 @@ FILES_AND_FOLDERS = [
     "./blender_manifest.toml",
     "./sort_xyz_files.py",
     "./convert_TIF_to_XYZ.py",
+    "./estimate_import_size.py",
+    "./import_pipeline.py",
 ]
 ROOT_DIR = "Import DGM"
 
@@ -2,6 +2,16 @@ import argparse
 import glob
 import os
 
+# Rows of a 1000m x 1000m grid with 1m resolution
+KM2_ROWS = 1000000
+
+# Allowed deviation from KM2_ROWS, e.g. for tiles including both edges (1001 x 1001)
+KM2_TOLERANCE = 0.1
+
+
+def is_km2_row_count(rows):
+    return abs(rows - KM2_ROWS) <= KM2_ROWS * KM2_TOLERANCE
+
 
 def sort_and_check_xyz_file(file_path, check_for_km2):
     try:
@@ -49,6 +59,25 @@ def sort_and_check_xyz_file(file_path, check_for_km2):
         return False
 
 
+def check_xyz_file(file_path, check_for_km2):
+    # Count the non-empty rows without parsing them
+    with open(file_path, "rb") as file:
+        rows = sum(1 for line in file if line.strip())
+
+    if rows == 0:
+        print(f"File {file_path} has no rows.")
+        return False
+
+    # A 1000m x 1000m grid with 1m resolution has about 1,000,000 rows,
+    # fewer rows are allowed since rows missing for nodata areas are filled
+    # in when the file is read
+    if check_for_km2 and rows > KM2_ROWS and not is_km2_row_count(rows):
+        print(f"File {file_path} has {rows} rows instead of about 1,000,000.")
+        return False
+
+    return True
+
+
 def sort_all_xyz_files_in_folder(folder_path, check_for_km2=True, multiprocessing=True):
     # Get all .xyz files in the folder
     xyz_files = glob.glob(os.path.join(folder_path, "*.xyz"))